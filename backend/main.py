@@ -1,14 +1,24 @@
 from fastapi import FastAPI, HTTPException, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field, StringConstraints
 from pymongo import AsyncMongoClient
+from pymongo.errors import DuplicateKeyError
 from passlib.context import CryptContext
-from jose import JWTError, jwt
-from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+import jwt
+from datetime import date, datetime, timedelta
+from typing import Annotated, Optional, Dict, Any, Tuple
 from contextlib import asynccontextmanager
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import base64
+import calendar
+import hashlib
+import hmac
+import json
 import os
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -16,15 +26,26 @@ load_dotenv()
 # Configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")
 ALGORITHM = "HS256"
+_SIGNING_KEY = SECRET_KEY.encode()
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+STREAK_LOOKBACK_DAYS = 400
+USER_CACHE_TTL_SECONDS = 60
+USER_CACHE_MAX_SIZE = 1024
+STREAKS_CACHE_TTL_SECONDS = 30
 MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "50"))
+MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", "10"))
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "10"))
 
 # Global variables for database connection
 client = None
 db = None
 
 # Password hashing - Using bcrypt instead of argon2 for better Docker compatibility
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+# Hashing is CPU-bound, so run it off the event loop
+_bcrypt_pool = ThreadPoolExecutor(max_workers=os.cpu_count())
 
 
 # Lifespan event handler
@@ -32,8 +53,15 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 async def lifespan(app: FastAPI):
     # Startup
     global client, db
-    client = AsyncMongoClient(MONGODB_URI)
+    client = AsyncMongoClient(
+        MONGODB_URI,
+        maxPoolSize=MONGODB_MAX_POOL_SIZE,
+        minPoolSize=MONGODB_MIN_POOL_SIZE,
+    )
     db = client.wellbeing_tracker
+    await db.users.create_index("username", unique=True)
+    await db.users.create_index("email", unique=True)
+    await db.checklists.create_index([("username", 1), ("date", -1)], unique=True)
     print("Connected to MongoDB")
 
     yield
@@ -59,17 +87,42 @@ app.add_middleware(
 # Security
 security = HTTPBearer()
 
+# Shared 401 for failed authentication; raise with a fresh traceback each time
+_CREDENTIALS_EXCEPTION = HTTPException(
+    status_code=status.HTTP_401_UNAUTHORIZED,
+    detail="Could not validate credentials",
+    headers={"WWW-Authenticate": "Bearer"},
+)
+
+# Authenticated user lookups, keyed by token: token -> (expiry, user)
+_user_cache: Dict[str, Tuple[float, dict]] = {}
+
+# Computed streaks, keyed by username: username -> (expiry, streaks).
+# Per-process only; use a shared store such as Redis when running multiple workers.
+_streaks_cache: Dict[str, Tuple[float, Dict[str, int]]] = {}
+
+
+# Passwords are kept verbatim even though other strings are stripped
+Password = Annotated[str, StringConstraints(strip_whitespace=False)]
+
+# Alias so the ChecklistItem.date field doesn't shadow its own type
+CalendarDate = date
+
 
 # Pydantic models
 class User(BaseModel):
+    model_config = ConfigDict(str_strip_whitespace=True)
+
     username: str
     email: str
-    password: str
+    password: Password
 
 
 class UserLogin(BaseModel):
+    model_config = ConfigDict(str_strip_whitespace=True)
+
     username: str
-    password: str
+    password: Password
 
 
 class Token(BaseModel):
@@ -85,7 +138,7 @@ class ChecklistItem(BaseModel):
     oiling: bool = False
     facemask: bool = False
     steps: Optional[int] = None
-    date: str = Field(default_factory=lambda: datetime.now().strftime("%Y-%m-%d"))
+    date: CalendarDate = Field(default_factory=date.today)
 
 
 class StreakData(BaseModel):
@@ -105,59 +158,107 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 
+async def verify_password_async(plain_password, hashed_password):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_bcrypt_pool, verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_bcrypt_pool, get_password_hash, password)
+
+
+def _b64url(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+# The header never changes, so encode it once
+_JWT_HEADER = _b64url(json.dumps({"alg": ALGORITHM, "typ": "JWT"}, separators=(",", ":")).encode())
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    to_encode.update({"exp": calendar.timegm(expire.utctimetuple())})
+
+    # Equivalent to jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    # but only the payload is serialized per token
+    payload = _b64url(json.dumps(to_encode, separators=(",", ":")).encode())
+    signing_input = _JWT_HEADER + b"." + payload
+    signature = hmac.new(_SIGNING_KEY, signing_input, hashlib.sha256).digest()
+    encoded_jwt = (signing_input + b"." + _b64url(signature)).decode()
     return encoded_jwt
 
 
+@lru_cache(maxsize=1024)
+def _decode_token(token: str) -> dict:
+    # Only successful decodes are cached; expiry is checked by the caller
+    return jwt.decode(token, _SIGNING_KEY, algorithms=[ALGORITHM])
+
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = _decode_token(credentials.credentials)
+        expire = payload.get("exp")
+        if expire is not None and expire <= time.time():
+            raise _CREDENTIALS_EXCEPTION.with_traceback(None)
         username: str = payload.get("sub")
         if username is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
+            raise _CREDENTIALS_EXCEPTION.with_traceback(None)
+    except jwt.InvalidTokenError:
+        raise _CREDENTIALS_EXCEPTION.with_traceback(None)
+
+    token = credentials.credentials
+    cached = _user_cache.get(token)
+    if cached and time.monotonic() < cached[0]:
+        return cached[1]
 
     user = await db.users.find_one({"username": username})
     if user is None:
-        raise credentials_exception
+        raise _CREDENTIALS_EXCEPTION.with_traceback(None)
+
+    now = time.monotonic()
+    if len(_user_cache) >= USER_CACHE_MAX_SIZE:
+        # Drop expired entries so stale tokens don't pile up
+        for key in [k for k, (expiry, _) in _user_cache.items() if expiry <= now]:
+            del _user_cache[key]
+    _user_cache[token] = (now + USER_CACHE_TTL_SECONDS, user)
     return user
 
 
-def is_valid_day_for_activity(activity: str, date_str: str) -> bool:
-    """Check if the given date is valid for specific activities"""
-    try:
-        date_obj = datetime.strptime(date_str, "%Y-%m-%d")
-        weekday = date_obj.weekday()  # 0=Monday, 1=Tuesday, ..., 6=Sunday
+# Activities restricted to certain weekdays (0=Monday, 1=Tuesday, ..., 6=Sunday)
+_WEEKDAY_GATED = {
+    "oiling": {1, 5},  # Tuesday and Saturday
+    "facemask": {2, 5},  # Wednesday and Saturday
+}
+
 
-        if activity == "oiling":
-            return weekday in [1, 5]  # Tuesday and Saturday
-        elif activity == "facemask":
-            return weekday in [2, 5]  # Wednesday and Saturday
+def _weekday_ok(activity: str, weekday: int) -> bool:
+    """Check if the given weekday is valid for specific activities"""
+    return activity not in _WEEKDAY_GATED or weekday in _WEEKDAY_GATED[activity]
 
-        return True
-    except ValueError:
-        return False
+
+def is_valid_day_for_activity(activity: str, day: date) -> bool:
+    """Check if the given date is valid for specific activities"""
+    return _weekday_ok(activity, day.weekday())
 
 
 async def calculate_streaks(username: str) -> Dict[str, int]:
     """Calculate current streaks for checkbox items"""
-    # Get all checklist entries for the user, sorted by date descending
+    # Get recent checklist entries for the user, sorted by date descending.
+    # Streaks can't reach further back than the lookback window.
+    current_date = date.today()
+    cutoff = (current_date - timedelta(days=STREAK_LOOKBACK_DAYS)).isoformat()
     entries = await db.checklists.find(
-        {"username": username}
-    ).sort("date", -1).to_list(None)
+        {"username": username, "date": {"$gte": cutoff}},
+        projection={
+            "date": 1, "pushups": 1, "situps": 1, "ab_crunches": 1,
+            "oiling": 1, "facemask": 1, "_id": 0
+        }
+    ).sort("date", -1).limit(STREAK_LOOKBACK_DAYS + 1).to_list(None)
 
     if not entries:
         return {"pushups": 0, "situps": 0, "ab_crunches": 0, "oiling": 0, "facemask": 0}
@@ -167,34 +268,25 @@ async def calculate_streaks(username: str) -> Dict[str, int]:
     # Convert to dict with date as key for easier processing
     entries_dict = {entry["date"]: entry for entry in entries}
 
-    # Start from today and go backwards
-    current_date = datetime.now().date()
-
-    for activity in streaks.keys():
-        streak_count = 0
-        check_date = current_date
+    # Start from today and walk backwards once, updating every streak that hasn't been broken yet
+    live = set(streaks)
+    check_date = current_date
 
-        while True:
-            date_str = check_date.strftime("%Y-%m-%d")
+    while live:
+        weekday = check_date.weekday()
+        entry = entries_dict.get(check_date.isoformat())
 
-            # Check if this activity is valid for this day
-            if not is_valid_day_for_activity(activity, date_str):
-                check_date -= timedelta(days=1)
+        for activity in list(live):
+            # Skip days this activity isn't scheduled for
+            if not _weekday_ok(activity, weekday):
                 continue
 
-            # Check if we have an entry for this date
-            if date_str in entries_dict:
-                entry = entries_dict[date_str]
-                if entry.get(activity, False):
-                    streak_count += 1
-                else:
-                    break
+            if entry and entry.get(activity, False):
+                streaks[activity] += 1
             else:
-                break
+                live.discard(activity)
 
-            check_date -= timedelta(days=1)
-
-        streaks[activity] = streak_count
+        check_date -= timedelta(days=1)
 
     return streaks
 
@@ -202,23 +294,8 @@ async def calculate_streaks(username: str) -> Dict[str, int]:
 # API Routes
 @app.post("/register", response_model=dict)
 async def register(user: User):
-    # Check if user already exists
-    existing_user = await db.users.find_one({"username": user.username})
-    if existing_user:
-        raise HTTPException(
-            status_code=400,
-            detail="Username already registered"
-        )
-
-    existing_email = await db.users.find_one({"email": user.email})
-    if existing_email:
-        raise HTTPException(
-            status_code=400,
-            detail="Email already registered"
-        )
-
     # Hash password and save user
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash_async(user.password)
     user_doc = {
         "username": user.username,
         "email": user.email,
@@ -226,15 +303,27 @@ async def register(user: User):
         "created_at": datetime.utcnow()
     }
 
-    await db.users.insert_one(user_doc)
+    # Unique indexes on username and email reject existing users
+    try:
+        await db.users.insert_one(user_doc)
+    except DuplicateKeyError as e:
+        key_pattern = (e.details or {}).get("keyPattern", {})
+        if "email" in key_pattern:
+            detail = "Email already registered"
+        else:
+            detail = "Username already registered"
+        raise HTTPException(status_code=400, detail=detail)
+
     return {"message": "User registered successfully"}
 
 
 @app.post("/token", response_model=Token)
 async def login(user: UserLogin):
     # Authenticate user
-    db_user = await db.users.find_one({"username": user.username})
-    if not db_user or not verify_password(user.password, db_user["hashed_password"]):
+    db_user = await db.users.find_one(
+        {"username": user.username}, projection={"hashed_password": 1}
+    )
+    if not db_user or not await verify_password_async(user.password, db_user["hashed_password"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -265,42 +354,52 @@ async def save_checklist(checklist: ChecklistItem, current_user: dict = Depends(
             detail="Facemask is only allowed on Wednesdays and Saturdays"
         )
 
-    # Prepare checklist document
-    checklist_doc = checklist.dict()
-    checklist_doc["username"] = current_user["username"]
-    checklist_doc["updated_at"] = datetime.utcnow()
+    # Prepare checklist document; dates are stored as ISO strings
+    date_str = checklist.date.isoformat()
+    checklist_doc = {
+        **checklist.model_dump(),
+        "date": date_str,
+        "username": current_user["username"],
+        "updated_at": datetime.utcnow(),
+    }
 
     # Upsert checklist entry
     await db.checklists.replace_one(
-        {"username": current_user["username"], "date": checklist.date},
+        {"username": current_user["username"], "date": date_str},
         checklist_doc,
         upsert=True
     )
 
+    # Streaks may have changed with this entry
+    _streaks_cache.pop(current_user["username"], None)
+
     return {"message": "Checklist saved successfully"}
 
 
 @app.get("/checklist/{date}")
-async def get_checklist(date: str, current_user: dict = Depends(get_current_user)):
+async def get_checklist(date: date, current_user: dict = Depends(get_current_user)):
+    # Leave out MongoDB internal fields
     checklist = await db.checklists.find_one(
-        {"username": current_user["username"], "date": date}
+        {"username": current_user["username"], "date": date.isoformat()},
+        projection={"_id": 0, "username": 0, "updated_at": 0}
     )
 
     if not checklist:
         # Return default checklist for the date
-        return ChecklistItem(date=date).dict()
-
-    # Remove MongoDB internal fields
-    checklist.pop("_id", None)
-    checklist.pop("username", None)
-    checklist.pop("updated_at", None)
+        return ChecklistItem(date=date).model_dump()
 
     return checklist
 
 
 @app.get("/streaks", response_model=StreakData)
 async def get_streaks(current_user: dict = Depends(get_current_user)):
-    streaks = await calculate_streaks(current_user["username"])
+    username = current_user["username"]
+    cached = _streaks_cache.get(username)
+    if cached and time.monotonic() < cached[0]:
+        return StreakData(**cached[1])
+
+    streaks = await calculate_streaks(username)
+    _streaks_cache[username] = (time.monotonic() + STREAKS_CACHE_TTL_SECONDS, streaks)
     return StreakData(**streaks)
 
 